@@ -36,24 +36,57 @@ def main():
                     st.error("Error en la validación de datos. Por favor, verifica los archivos.")
                     return
 
-                # Configuración de clasificación
+                # Configuración de clasificación: las medianas de referencia se
+                # calculan una vez por archivo de la semana actual
+                if st.session_state.get('reference_file_id') != current_week_file.file_id:
+                    st.session_state.reference_values = calculate_reference_values(df_current)
+                    st.session_state.reference_file_id = current_week_file.file_id
+                default_rate, default_uit = st.session_state.reference_values
                 with st.expander("Configuración de Rate y UIT de referencia"):
                     user_rate = st.number_input(
                         "Rate de Referencia",
                         min_value=0.0,
-                        value=float(round(df_current['RATES'].median(), 2)),
+                        value=default_rate,
                         help="Rate objetivo para evaluación de rendimiento"
                     )
                     user_uit = st.number_input(
                         "UIT de Referencia",
                         min_value=0.0,
-                        value=float(round(df_current['UIT'].median(), 2)),
+                        value=default_uit,
                         help="Porcentaje objetivo de Unknown Idle Time"
                     )
                 
-                # Aplicar clasificación por zonas
-                df_last = apply_zone_classification(df_last, user_rate, user_uit)
-                df_current = apply_zone_classification(df_current, user_rate, user_uit)
+                # Reutilizar la clasificación de la ejecución anterior si no cambiaron
+                # ni los archivos ni las referencias
+                inputs_sig = (
+                    last_week_file.file_id,
+                    current_week_file.file_id,
+                    user_rate,
+                    user_uit
+                )
+                if (st.session_state.data_processed
+                        and st.session_state.get('inputs_sig') == inputs_sig):
+                    df_last = st.session_state.df_last_clf
+                    df_current = st.session_state.df_current_clf
+                    comparison_df = st.session_state.comparison_df
+                    comparison_by_id = st.session_state.comparison_by_id
+                else:
+                    # Aplicar clasificación por zonas
+                    df_last = apply_zone_classification(df_last, user_rate, user_uit)
+                    df_current = apply_zone_classification(df_current, user_rate, user_uit)
+                    
+                    # Crear DataFrame de comparación
+                    comparison_df = create_comparison_dataframe(df_last, df_current)
+                    # Indexada por ID para las búsquedas del reporte individual
+                    comparison_by_id = (
+                        comparison_df.set_index('ID', drop=False) if comparison_df is not None else None
+                    )
+                    
+                    st.session_state.inputs_sig = inputs_sig
+                    st.session_state.df_last_clf = df_last
+                    st.session_state.df_current_clf = df_current
+                    st.session_state.comparison_df = comparison_df
+                    st.session_state.comparison_by_id = comparison_by_id
                 
                 # Visualización principal
                 display_current_week_scatter(df_current, user_rate, user_uit)
@@ -67,15 +100,12 @@ def main():
                 
                 # Filtrar por zona seleccionada
                 df_last_filtered, df_current_filtered = filter_by_zone(
-                    df_last, df_current, selected_zone
+                    df_last, df_current, selected_zone, inputs_sig
                 )
                 
                 # Mostrar métricas comparativas
                 display_comparative_metrics(df_last_filtered, df_current_filtered)
                 
-                # Crear DataFrame de comparación
-                comparison_df = create_comparison_dataframe(df_last, df_current)
-                
                 if comparison_df is not None:
                     # Mostrar sección de comparación
                     display_comparison_section(comparison_df, df_current)
@@ -85,24 +115,13 @@ def main():
                     
                     # Transiciones de zona
                     st.subheader("Análisis de Transiciones de Zona")
-                    zone_transitions = calculate_zone_transitions(df_last, df_current)
+                    zone_transitions = calculate_zone_transitions(comparison_df)
                     if zone_transitions is not None:
                         st.write("Matriz de Transiciones de Zona:")
-                        st.dataframe(zone_transitions)
+                        st.table(zone_transitions)
                     
                     # Reporte individual
-                    st.subheader("Reporte Individual")
-                    selected_worker = st.selectbox(
-                        "Seleccionar trabajador:",
-                        comparison_df['ID'].unique()
-                    )
-                    
-                    if selected_worker:
-                        worker_report = generate_individual_report(
-                            selected_worker, comparison_df
-                        )
-                        if worker_report:
-                            st.write(worker_report)
+                    display_individual_report(comparison_by_id)
                     
                     # Sección de exportación
                     export_section(comparison_df)
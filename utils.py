@@ -1,11 +1,9 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import numpy as np
 import logging
 from datetime import datetime
 import io
-import openpyxl
 from io import BytesIO
 # Configuración de logging
 logging.basicConfig(
@@ -18,20 +16,23 @@ logging.basicConfig(
 )
 
 # Constantes
-REQUIRED_COLUMNS = ['User_Id', 'Stow_Rate', 'Turnaway_Percentage']
 COLUMN_MAPPINGS = {
     'User_Id': 'ID',
     'Stow_Rate': 'RATES',
-    'Turnaway_Percentage': 'UIT'
+    'UIT': 'UIT',
+    'Entry_Date': 'DATE'
 }
+REQUIRED_COLUMNS = list(COLUMN_MAPPINGS)
 ZONE_COLORS = {
     'Zone 1: High Rate & High UIT': 'red',
     'Zone 2: High Rate & Low UIT': 'green',
     'Zone 3: Low Rate & High UIT': 'orange',
     'Zone 4: Low Rate & Low UIT': 'blue'
 }
+ZONE_LABELS = tuple(ZONE_COLORS)
+ZONE_DTYPE = pd.CategoricalDtype(categories=ZONE_LABELS, ordered=False)
+MAX_SCATTER_POINTS_PER_ZONE = 5000
 
-@st.cache_data
 def setup_page():
     """Configura la página de Streamlit"""
     st.set_page_config(
@@ -66,129 +67,267 @@ def load_files():
     
     return last_week_file, current_week_file
 
+def _read_excel(file_bytes):
+    """Lee el archivo Excel subido"""
+    # Solo se leen las columnas que usa la aplicación
+    try:
+        # python-calamine parsea en Rust, mucho más rápido que openpyxl
+        return pd.read_excel(BytesIO(file_bytes), engine='calamine', usecols=REQUIRED_COLUMNS)
+    except ImportError:
+        logging.warning("python-calamine no disponible, usando el motor por defecto")
+        return pd.read_excel(BytesIO(file_bytes), usecols=REQUIRED_COLUMNS)
+
+# Caché acotada: cada subida tiene un file_id nuevo, aunque sea el mismo archivo
+@st.cache_data(show_spinner=False, max_entries=10, ttl=3600)
+def _process_data(file_id, week_identifier, _file):
+    """Procesa y valida los datos de un archivo; se recalcula solo si se sube otro archivo
+    
+    La clave de caché es el file_id de la subida: _file no se hashea, así que
+    los bytes solo se leen cuando hay que volver a procesar.
+    """
+    # Leer archivo Excel
+    df = _read_excel(_file.getvalue())
+    
+    # Renombrar columnas para mantener consistencia con el resto del código
+    df.rename(columns=COLUMN_MAPPINGS, inplace=True)
+    
+    # Validar que las columnas necesarias existan
+    required_columns = ['ID', 'RATES', 'UIT', 'DATE']
+    if not all(col in df.columns for col in required_columns):
+        raise ValueError("Faltan columnas requeridas en el archivo")
+    
+    # Convertir la columna de fecha al formato correcto
+    df['DATE'] = pd.to_datetime(df['DATE'], format='%d/%m/%Y')
+    
+    # Convertir RATES y UIT a float si no lo están ya
+    rates = pd.to_numeric(df['RATES'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    uits = pd.to_numeric(df['UIT'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    
+    # Si el UIT está en notación científica, convertirlo a decimal normal
+    scientific = uits > 100
+    if scientific.any():
+        uits = np.where(scientific, uits / 10**16, uits)
+    
+    # Una sola máscara de filas válidas (sin nulos) para todas las validaciones
+    valid = ~(np.isnan(rates) | np.isnan(uits))
+    valid &= df['ID'].notna().to_numpy() & df['DATE'].notna().to_numpy()
+    
+    # Validar que los datos numéricos sean válidos
+    if (valid & ((rates < 0) | (uits < 0))).any():
+        raise ValueError("Se encontraron valores negativos en RATES o UIT")
+    
+    # Se mantiene float64: los valores exportados y comparados deben ser los del archivo
+    df['RATES'] = rates
+    df['UIT'] = uits
+    
+    # IDs de texto respaldados por Arrow: el merge entre semanas hashea en C++
+    if pd.api.types.is_object_dtype(df['ID']):
+        df['ID'] = df['ID'].astype('string[pyarrow]')
+    
+    # Eliminar filas con valores nulos en un único filtrado
+    if not valid.all():
+        logging.warning(
+            f"{week_identifier}: {int((~valid).sum())} filas descartadas por valores nulos"
+        )
+        df = df[valid]
+    
+    return df
+
 def validate_and_process_data(file, week_identifier):
     try:
-        # Leer archivo Excel
-        df = pd.read_excel(file)
-        
-        # Renombrar columnas para mantener consistencia con el resto del código
-        column_mapping = {
-            'User_Id': 'ID',
-            'Stow_Rate': 'RATES',
-            'UIT': 'UIT',
-            'Entry_Date': 'DATE'
-        }
-        
-        df = df.rename(columns=column_mapping)
-        
-        # Convertir la columna de fecha al formato correcto
-        df['DATE'] = pd.to_datetime(df['DATE'], format='%d/%m/%Y')
-        
-        # Convertir RATES y UIT a float si no lo están ya
-        df['RATES'] = pd.to_numeric(df['RATES'], errors='coerce')
-        df['UIT'] = pd.to_numeric(df['UIT'], errors='coerce')
-        
-        # Si el UIT está en notación científica, convertirlo a decimal normal
-        if (df['UIT'] > 100).any():
-            df['UIT'] = df['UIT'].apply(lambda x: x / 10**16 if x > 100 else x)
-        
-        # Eliminar filas con valores nulos
-        df = df.dropna(subset=['ID', 'RATES', 'UIT', 'DATE'])
-        
-        # Validar que las columnas necesarias existan
-        required_columns = ['ID', 'RATES', 'UIT', 'DATE']
-        if not all(col in df.columns for col in required_columns):
-            raise ValueError("Faltan columnas requeridas en el archivo")
-        
-        # Validar que los datos numéricos sean válidos
-        if (df['RATES'] < 0).any() or (df['UIT'] < 0).any():
-            raise ValueError("Se encontraron valores negativos en RATES o UIT")
-        
-        return df
+        # Solo se vuelve a parsear cuando el usuario sube un archivo distinto
+        return _process_data(file.file_id, week_identifier, file)
         
     except Exception as e:
         logging.error(f"Error procesando archivo {week_identifier}: {str(e)}")
         st.error(f"Error procesando archivo {week_identifier}: {str(e)}")
         return None
 
+def calculate_reference_values(df):
+    """Calcula las medianas de Rate y UIT usadas como referencia por defecto"""
+    return (
+        float(round(df['RATES'].median(), 2)),
+        float(round(df['UIT'].median(), 2))
+    )
+
+def _zone_codes(rates, uits, user_rate, user_uit):
+    """Calcula el código de zona de 2 bits: (rate bajo << 1) | UIT bajo
+    
+    0 = Zone 1, 1 = Zone 2, 2 = Zone 3, 3 = Zone 4. Todas las operaciones
+    escriben en dos buffers preasignados, sin arrays temporales intermedios.
+    """
+    codes = np.empty(len(rates), dtype=np.uint8)
+    mask = np.empty(len(rates), dtype=bool)
+    
+    # Bit 1: rate bajo (bool se reinterpreta como uint8 sin copiar)
+    np.greater(rates, user_rate, out=mask)
+    np.invert(mask, out=mask)
+    np.left_shift(mask.view(np.uint8), 1, out=codes)
+    
+    # Bit 0: UIT bajo
+    np.greater(uits, user_uit, out=mask)
+    np.invert(mask, out=mask)
+    np.bitwise_or(codes, mask.view(np.uint8), out=codes)
+    return codes
+
 def apply_zone_classification(df, user_rate, user_uit):
     """Aplica la clasificación por zonas"""
     try:
-        df['Zone'] = df.apply(
-            lambda row: classify_zone(row, user_rate, user_uit),
-            axis=1
+        df = df.copy()
+        
+        codes = _zone_codes(
+            df['RATES'].to_numpy(), df['UIT'].to_numpy(), user_rate, user_uit
         )
+        df['Zone'] = pd.Categorical.from_codes(codes, dtype=ZONE_DTYPE)
         return df
     except Exception as e:
         logging.error(f"Error in zone classification: {str(e)}")
         st.error("Error classifying zones")
         return None
 
+def _count_by_zone(df):
+    """Cuenta asociados por zona con un bincount sobre los códigos categóricos"""
+    counts = np.bincount(df['Zone'].cat.codes.to_numpy(), minlength=len(ZONE_LABELS))
+    return pd.Series(counts, index=ZONE_LABELS)
+
 def classify_zone(row, user_rate, user_uit):
-    """Clasifica una fila en su zona correspondiente"""
-    if row['RATES'] > user_rate and row['UIT'] > user_uit:
-        return 'Zone 1: High Rate & High UIT'
-    elif row['RATES'] > user_rate and row['UIT'] <= user_uit:
-        return 'Zone 2: High Rate & Low UIT'
-    elif row['RATES'] <= user_rate and row['UIT'] > user_uit:
-        return 'Zone 3: Low Rate & High UIT'
-    else:
-        return 'Zone 4: Low Rate & Low UIT'
+    """Clasifica una fila en su zona correspondiente (versión escalar de apply_zone_classification)"""
+    code = (int(not row['RATES'] > user_rate) << 1) | int(not row['UIT'] > user_uit)
+    return ZONE_LABELS[code]
+
+def _lttb_indices(x, y, n_out):
+    """Selecciona n_out índices con Largest-Triangle-Three-Buckets (x ordenado)"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    # Primer y último punto fijos; el resto se reparte en n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        
+        # Promedio del bucket siguiente (o el último punto)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        
+        # Punto del bucket que forma el triángulo de mayor área
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    
+    return selected
 
+def downsample_scatter(df, max_points=MAX_SCATTER_POINTS_PER_ZONE):
+    """Reduce los puntos por zona con LTTB conservando las filas originales"""
+    if len(df) <= max_points:
+        return df
+    
+    parts = []
+    for _, group in df.groupby('Zone', observed=True, sort=False):
+        if len(group) > max_points:
+            group = group.sort_values('RATES')
+            idx = _lttb_indices(
+                group['RATES'].to_numpy(dtype=float),
+                group['UIT'].to_numpy(dtype=float),
+                max_points
+            )
+            group = group.iloc[idx]
+        parts.append(group)
+    return pd.concat(parts)
+
+# Caché acotada: cada par de referencias genera una figura distinta y la
+# caché de recursos es compartida por todas las sesiones
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_current_week_scatter(df_current, user_rate, user_uit):
+    """Construye el gráfico de dispersión; se reutiliza mientras no cambien datos o referencias"""
+    # Import diferido: plotly solo se carga cuando se dibuja el primer gráfico
+    import plotly.graph_objects as go
+    
+    fig = go.Figure()
+    
+    # Una traza WebGL por zona con los arrays ya calculados
+    # (con muchos asociados se reduce cada zona antes de pasarla a Plotly)
+    plot_df = downsample_scatter(df_current)
+    for zone, sub in plot_df.groupby('Zone', observed=True):
+        fig.add_trace(go.Scattergl(
+            # float32 solo en los arrays que se envían al navegador (mitad de bytes)
+            x=sub['RATES'].to_numpy(dtype=np.float32),
+            y=sub['UIT'].to_numpy(dtype=np.float32),
+            mode='markers',
+            name=zone,
+            marker_color=ZONE_COLORS[zone],
+            hovertext=sub['ID'].to_numpy(),
+            hovertemplate='<b>%{hovertext}</b><br>Rate=%{x:.2f}<br>Unknown Idle Time (%)=%{y:.2f}<extra></extra>'
+        ))
+    
+    # Agregar líneas de referencia como shapes (sin add_hline/add_vline)
+    fig.add_shape(
+        type='line',
+        name='uit_ref',
+        xref='paper', x0=0, x1=1,
+        y0=user_uit, y1=user_uit,
+        line=dict(dash='dash', color='gray'),
+        label=dict(text='UIT Reference', textposition='end')
+    )
+    fig.add_shape(
+        type='line',
+        name='rate_ref',
+        yref='paper', y0=0, y1=1,
+        x0=user_rate, x1=user_rate,
+        line=dict(dash='dash', color='gray'),
+        label=dict(text='Rate Reference', textposition='end')
+    )
+    
+    # Configurar rangos dinámicos
+    rate_padding = (df_current['RATES'].max() - df_current['RATES'].min()) * 0.1
+    uit_padding = (df_current['UIT'].max() - df_current['UIT'].min()) * 0.1
+    
+    fig.update_layout(
+        title='Current Week Zone Classification',
+        legend_title_text='Zone',
+        # uirevision constante: Plotly.react conserva zoom/selección entre reruns
+        uirevision='current_week_scatter',
+        xaxis=dict(
+            title='Rate',
+            range=[df_current['RATES'].min() - rate_padding,
+                   df_current['RATES'].max() + rate_padding]
+        ),
+        yaxis=dict(
+            title='Unknown Idle Time (%)',
+            range=[max(0, df_current['UIT'].min() - uit_padding),
+                   min(100, df_current['UIT'].max() + uit_padding)]
+        ),
+        hoverlabel=dict(bgcolor="white"),
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="right",
+            x=0.99
+        )
+    )
+    
+    return fig
 
 def display_current_week_scatter(df_current, user_rate, user_uit):
     """Muestra el gráfico de dispersión de la semana actual"""
     try:
-        fig = px.scatter(
-            df_current,
-            x='RATES',
-            y='UIT',
-            color='Zone',
-            hover_name='ID',
-            title='Current Week Zone Classification',
-            labels={'RATES': 'Rate', 'UIT': 'Unknown Idle Time (%)'},
-            color_discrete_map=ZONE_COLORS
-        )
-        
-        # Agregar líneas de referencia
-        fig.add_hline(
-            y=user_uit,
-            line_dash="dash",
-            line_color="gray",
-            annotation_text="UIT Reference"
-        )
-        fig.add_vline(
-            x=user_rate,
-            line_dash="dash",
-            line_color="gray",
-            annotation_text="Rate Reference"
-        )
-        
-        # Configurar rangos dinámicos
-        rate_padding = (df_current['RATES'].max() - df_current['RATES'].min()) * 0.1
-        uit_padding = (df_current['UIT'].max() - df_current['UIT'].min()) * 0.1
-        
-        fig.update_layout(
-            xaxis=dict(
-                title='Rate',
-                range=[df_current['RATES'].min() - rate_padding,
-                       df_current['RATES'].max() + rate_padding]
-            ),
-            yaxis=dict(
-                title='Unknown Idle Time (%)',
-                range=[max(0, df_current['UIT'].min() - uit_padding),
-                       min(100, df_current['UIT'].max() + uit_padding)]
-            ),
-            hoverlabel=dict(bgcolor="white"),
-            legend=dict(
-                yanchor="top",
-                y=0.99,
-                xanchor="right",
-                x=0.99
-            )
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
+        # La figura está compartida en caché: no se modifica aquí.
+        # La key estable mantiene el mismo componente, que se actualiza con
+        # Plotly.react en lugar de volver a montarse
+        fig = build_current_week_scatter(df_current, user_rate, user_uit)
+        st.plotly_chart(fig, use_container_width=True, key='current_week_scatter')
         
     except Exception as e:
         logging.error(f"Error en scatter plot: {str(e)}")
@@ -196,9 +335,11 @@ def display_current_week_scatter(df_current, user_rate, user_uit):
 
 def display_zone_distribution(df_current):
     """Muestra la distribución de zonas y análisis de antigüedad"""
+    import plotly.express as px
+    
     try:
         st.subheader("Current Week Zone Distribution")
-        zone_counts = df_current['Zone'].value_counts()
+        zone_counts = _count_by_zone(df_current)
         
         # Primera fila: Distribución de zonas
         col1, col2 = st.columns([2,1])
@@ -225,11 +366,23 @@ def display_zone_distribution(df_current):
         st.markdown("---")
         
         # Segunda sección: Análisis de antigüedad
+        display_tenure_analysis(df_current)
+                
+    except Exception as e:
+        logging.error(f"Error en distribución de zonas: {str(e)}")
+        st.error("Error al mostrar la distribución de zonas")
+
+@st.fragment
+def display_tenure_analysis(df_current):
+    """Muestra el análisis de antigüedad; el selector de zona solo recarga esta sección"""
+    import plotly.express as px
+    
+    try:
         st.subheader("Tenure Analysis by Zone")
         
         selected_zone = st.selectbox(
             "Select Zone for Tenure Analysis:",
-            ['All Zones'] + list(df_current['Zone'].unique()),
+            ['All Zones', *ZONE_LABELS],
             key='tenure_zone_selector'
         )
         
@@ -238,6 +391,11 @@ def display_zone_distribution(df_current):
             zone_df = df_current[df_current['Zone'] == selected_zone].copy()  # Crear copia explícita
         else:
             zone_df = df_current.copy()  # Crear copia explícita
+        
+        # Las zonas son fijas, por lo que una zona puede no tener asociados esta semana
+        if zone_df.empty:
+            st.info(f"No hay asociados en {selected_zone} esta semana")
+            return
             
         # Nueva fila para el análisis de antigüedad
         tenure_col1, tenure_col2 = st.columns([2,1])
@@ -276,21 +434,34 @@ def display_zone_distribution(df_current):
                 st.error(f"Error en los detalles de antigüedad: {str(e)}")
                 
     except Exception as e:
-        logging.error(f"Error en distribución de zonas: {str(e)}")
-        st.error("Error al mostrar la distribución de zonas")
-
+        logging.error(f"Error en análisis de antigüedad: {str(e)}")
+        st.error("Error al mostrar el análisis de antigüedad")
+
+
+def partition_by_zone(df_last, df_current):
+    """Parte ambas semanas por zona con un groupby cada una"""
+    last_parts = dict(tuple(df_last.groupby('Zone', observed=True, sort=False)))
+    current_parts = dict(tuple(df_current.groupby('Zone', observed=True, sort=False)))
+    return {
+        zone: (
+            last_parts.get(zone, df_last.iloc[:0]),
+            current_parts.get(zone, df_current.iloc[:0])
+        )
+        for zone in ZONE_LABELS
+    }
 
-def filter_by_zone(df_last, df_current, selected_zone):
+def filter_by_zone(df_last, df_current, selected_zone, inputs_sig):
     """Filtra los DataFrames por zona seleccionada"""
     try:
-        if selected_zone != 'All Zones':
-            df_last_filtered = df_last[df_last['Zone'] == selected_zone]
-            df_current_filtered = df_current[df_current['Zone'] == selected_zone]
-        else:
-            df_last_filtered = df_last
-            df_current_filtered = df_current
-            
-        return df_last_filtered, df_current_filtered
+        if selected_zone == 'All Zones':
+            return df_last, df_current
+        
+        # Las particiones se construyen la primera vez que se pide una zona
+        # concreta y se reutilizan mientras no cambie la clasificación
+        if st.session_state.get('zone_partitions_sig') != inputs_sig:
+            st.session_state.zone_partitions = partition_by_zone(df_last, df_current)
+            st.session_state.zone_partitions_sig = inputs_sig
+        return st.session_state.zone_partitions.get(selected_zone, (df_last, df_current))
         
     except Exception as e:
         logging.error(f"Error en filtrado por zona: {str(e)}")
@@ -299,21 +470,24 @@ def filter_by_zone(df_last, df_current, selected_zone):
 def create_comparison_dataframe(df_last, df_current):
     """Crea el DataFrame de comparación"""
     try:
-        comparison_df = pd.merge(
-            df_last[['ID', 'RATES', 'UIT', 'Zone']].rename(
-                columns={'RATES': 'Last_Rate', 'UIT': 'Last_UIT', 'Zone': 'Last_Zone'}
-            ),
-            df_current[['ID', 'RATES', 'UIT', 'Zone']].rename(
-                columns={'RATES': 'Current_Rate', 'UIT': 'Current_UIT'}
-            ),
-            on='ID',
-            how='inner'
+        # Unir por índice (ID); validate detecta IDs duplicados en cualquiera de las semanas
+        last = df_last.set_index('ID')[['RATES', 'UIT', 'Zone']].rename(
+            columns={'RATES': 'Last_Rate', 'UIT': 'Last_UIT', 'Zone': 'Last_Zone'}
         )
+        current = df_current.set_index('ID')[['RATES', 'UIT', 'Zone']].rename(
+            columns={'RATES': 'Current_Rate', 'UIT': 'Current_UIT'}
+        )
+        comparison_df = last.join(current, how='inner', validate='1:1').reset_index()
         
         # Calcular cambios
         comparison_df['Rate_Change'] = comparison_df['Current_Rate'] - comparison_df['Last_Rate']
         comparison_df['UIT_Change'] = comparison_df['Current_UIT'] - comparison_df['Last_UIT']
-        comparison_df['Zone_Changed'] = comparison_df['Zone'] != comparison_df['Last_Zone']
+        
+        # Las zonas comparten categorías: comparar directamente los códigos enteros
+        comparison_df['Zone_Changed'] = (
+            comparison_df['Zone'].cat.codes.to_numpy()
+            != comparison_df['Last_Zone'].cat.codes.to_numpy()
+        )
         
         return comparison_df
         
@@ -325,35 +499,41 @@ def create_comparison_dataframe(df_last, df_current):
 def display_comparative_metrics(df_last_filtered, df_current_filtered):
     """Muestra métricas comparativas"""
     try:
+        # Una sola agregación por semana en lugar de recalcular cada estadístico
+        cur = df_current_filtered[['RATES', 'UIT']].agg(['mean', 'median'])
+        last = df_last_filtered[['RATES', 'UIT']].agg(['mean', 'median'])
+        n_cur = len(df_current_filtered)
+        n_last = len(df_last_filtered)
+        
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
             display_metric(
                 "Number of Associates",
-                len(df_current_filtered),
-                len(df_current_filtered) - len(df_last_filtered)
+                n_cur,
+                n_cur - n_last
             )
         
         with col2:
             display_metric(
                 "Average Rate",
-                df_current_filtered['RATES'].mean(),
-                df_current_filtered['RATES'].mean() - df_last_filtered['RATES'].mean()
+                cur.loc['mean', 'RATES'],
+                cur.loc['mean', 'RATES'] - last.loc['mean', 'RATES']
             )
         
         with col3:
             display_metric(
                 "Average UIT",
-                df_current_filtered['UIT'].mean(),
-                df_current_filtered['UIT'].mean() - df_last_filtered['UIT'].mean(),
+                cur.loc['mean', 'UIT'],
+                cur.loc['mean', 'UIT'] - last.loc['mean', 'UIT'],
                 suffix="%"
             )
             
         with col4:
             display_metric(
                 "Median Rate",
-                df_current_filtered['RATES'].median(),
-                df_current_filtered['RATES'].median() - df_last_filtered['RATES'].median()
+                cur.loc['median', 'RATES'],
+                cur.loc['median', 'RATES'] - last.loc['median', 'RATES']
             )
             
     except Exception as e:
@@ -380,23 +560,25 @@ def create_excel_report(df):
         if df is None or df.empty:
             raise ValueError("No hay datos para exportar")
 
-        # Crear el Excel writer especificando el engine
+        # Crear el Excel writer con xlsxwriter (escribe directamente al zip,
+        # sin construir el árbol de objetos de openpyxl). No se usa
+        # constant_memory: pandas escribe por columnas y ese modo descarta
+        # las filas ya cerradas.
         with pd.ExcelWriter(
             buffer,
-            engine='openpyxl',
-            mode='w'
+            engine='xlsxwriter'
         ) as writer:
             # Hoja 1: Comparación Detallada
+            float_cols = [
+                'Last_Rate', 'Current_Rate', 'Rate_Change',
+                'Last_UIT', 'Current_UIT', 'UIT_Change'
+            ]
+            # Selección y redondeo en una sola pasada
             comparison_sheet = df[[
                 'ID',
-                'Last_Rate', 'Current_Rate', 'Rate_Change',
-                'Last_UIT', 'Current_UIT', 'UIT_Change',
+                *float_cols,
                 'Zone_Changed'  # Cambiado de 'Zone' a 'Zone_Changed'
-            ]].copy()
-            
-            # Redondear valores numéricos
-            for col in comparison_sheet.select_dtypes(include=['float64']):
-                comparison_sheet[col] = comparison_sheet[col].round(2)
+            ]].round(2)
             
             comparison_sheet.to_excel(
                 writer,
@@ -404,7 +586,12 @@ def create_excel_report(df):
                 index=False
             )
 
-            # Hoja 2: Resumen
+            # Hoja 2: Resumen (todo sale de los mismos arrays, sin sub-DataFrames)
+            rc = df['Rate_Change'].to_numpy()
+            uc = df['UIT_Change'].to_numpy()
+            zc = df['Zone_Changed'].to_numpy()
+            rate_up = rc > 0
+            uit_down = uc < 0
             summary_data = pd.DataFrame({
                 'Metric': [
                     'Total Associates',
@@ -417,12 +604,12 @@ def create_excel_report(df):
                 ],
                 'Value': [
                     len(df),
-                    len(df[df['Rate_Change'] > 0]),
-                    len(df[df['UIT_Change'] < 0]),
-                    len(df[(df['Rate_Change'] > 0) & (df['UIT_Change'] < 0)]),
-                    round(df['Rate_Change'].mean(), 2),
-                    round(df['UIT_Change'].mean(), 2),
-                    len(df[df['Zone_Changed']])  # Conteo de cambios de zona
+                    int(rate_up.sum()),
+                    int(uit_down.sum()),
+                    int((rate_up & uit_down).sum()),
+                    round(rc.mean(), 2),
+                    round(uc.mean(), 2),
+                    int(zc.sum())  # Conteo de cambios de zona
                 ]
             })
             
@@ -485,7 +672,10 @@ def export_section(comparison_df):
 def convert_to_csv(df):
     """Convierte DataFrame a CSV"""
     try:
-        return df.to_csv(index=False).encode('utf-8')
+        # Escribir los bytes UTF-8 directamente en el buffer (sin str intermedio)
+        buffer = BytesIO()
+        df.to_csv(buffer, index=False, encoding='utf-8')
+        return buffer.getvalue()
     except Exception as e:
         logging.error(f"Error en conversión a CSV: {str(e)}")
         st.error("Error al convertir a CSV")
@@ -507,14 +697,16 @@ def display_comparison_section(comparison_df, df_current):
             display_performance_analysis(comparison_df)
 
         with tab2:
+            # Una sola selección parcial por columna, compartida por ambas vistas
+            movers = calculate_movers(comparison_df)
             col1, col2 = st.columns(2)
             with col1:
-                display_top_movers(comparison_df)
+                display_top_movers(movers)
             with col2:
-                display_bottom_movers(comparison_df)
+                display_bottom_movers(movers)
 
         with tab3:
-            display_recommendations(comparison_df, df_current)
+            display_recommendations(comparison_df)
 
     except Exception as e:
         logging.error(f"Error en la sección de comparación: {str(e)}")
@@ -529,52 +721,73 @@ def display_performance_analysis(comparison_df):
 
         st.subheader("Tendencias de Rendimiento")
 
-        # Análisis de mejoras
-        improvement_data = {
-            'Metric': [],
-            'Value': [],
-            'Percentage': []
-        }
-
-        total_associates = len(comparison_df)
-        
-        # Rate improvements
-        rate_improved = len(comparison_df[comparison_df['Rate_Change'] > 0])
-        rate_improved_pct = (rate_improved / total_associates * 100)
-        improvement_data['Metric'].append('Mejora en Rate')
-        improvement_data['Value'].append(rate_improved)
-        improvement_data['Percentage'].append(f"{rate_improved_pct:.1f}%")
-
-        # UIT improvements
-        uit_improved = len(comparison_df[comparison_df['UIT_Change'] < 0])
-        uit_improved_pct = (uit_improved / total_associates * 100)
-        improvement_data['Metric'].append('Mejora en UIT')
-        improvement_data['Value'].append(uit_improved)
-        improvement_data['Percentage'].append(f"{uit_improved_pct:.1f}%")
-
-        # Overall improvements
-        overall_improved = len(comparison_df[
-            (comparison_df['Rate_Change'] > 0) &
-            (comparison_df['UIT_Change'] < 0)
-        ])
-        overall_improved_pct = (overall_improved / total_associates * 100)
-        improvement_data['Metric'].append('Mejora General')
-        improvement_data['Value'].append(overall_improved)
-        improvement_data['Percentage'].append(f"{overall_improved_pct:.1f}%")
+        # Conteos sobre arrays y tabla construida de una vez
+        rc = comparison_df['Rate_Change'].to_numpy()
+        uc = comparison_df['UIT_Change'].to_numpy()
+        total_associates = rc.size
+        
+        rate_improved = int((rc > 0).sum())
+        uit_improved = int((uc < 0).sum())
+        overall_improved = int(((rc > 0) & (uc < 0)).sum())
+        
+        improvement_df = pd.DataFrame.from_records(
+            [
+                ('Mejora en Rate', rate_improved, f"{rate_improved / total_associates * 100:.1f}%"),
+                ('Mejora en UIT', uit_improved, f"{uit_improved / total_associates * 100:.1f}%"),
+                ('Mejora General', overall_improved, f"{overall_improved / total_associates * 100:.1f}%")
+            ],
+            columns=['Metric', 'Value', 'Percentage']
+        )
 
         # Mostrar tabla de mejoras
         st.write("Resumen de Mejoras:")
-        improvement_df = pd.DataFrame(improvement_data)
         st.dataframe(improvement_df, use_container_width=True)
 
     except Exception as e:
         logging.error(f"Error en análisis de rendimiento: {str(e)}")
         st.error("Error al mostrar el análisis de rendimiento")
 
-def display_top_movers(comparison_df):
+def _extreme_indices(values, k, largest):
+    """Posiciones de los k valores extremos, ordenadas como nlargest/nsmallest (keep='first')"""
+    k = min(k, len(values))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    keys = -values if largest else values
+    
+    # Valor de corte por selección parcial; los empates en el corte se
+    # resuelven por orden de fila, igual que keep='first'
+    cutoff = np.partition(keys, k - 1)[k - 1]
+    inside = np.flatnonzero(keys < cutoff)
+    ties = np.flatnonzero(keys == cutoff)[:k - len(inside)]
+    idx = np.concatenate((inside, ties))
+    
+    # Ordenar por valor y, a igualdad, por posición
+    return idx[np.lexsort((idx, keys[idx]))]
+
+def calculate_movers(comparison_df, k=5):
+    """Calcula las tablas de top y bottom movers con argpartition"""
+    rc = comparison_df['Rate_Change'].to_numpy()
+    uc = comparison_df['UIT_Change'].to_numpy()
+    rate_cols = ['ID', 'Last_Rate', 'Current_Rate', 'Rate_Change']
+    uit_cols = ['ID', 'Last_UIT', 'Current_UIT', 'UIT_Change']
+
+    def _table(idx, cols):
+        # Redondear solo las k filas mostradas
+        table = comparison_df.iloc[idx][cols].copy()
+        table[cols[1:]] = table[cols[1:]].round(2)
+        return table
+
+    return {
+        'top_rate': _table(_extreme_indices(rc, k, largest=True), rate_cols),
+        'top_uit': _table(_extreme_indices(uc, k, largest=False), uit_cols),
+        'bottom_rate': _table(_extreme_indices(rc, k, largest=False), rate_cols),
+        'bottom_uit': _table(_extreme_indices(uc, k, largest=True), uit_cols)
+    }
+
+def display_top_movers(movers):
     """Muestra los mejores movers"""
     try:
-        if comparison_df.empty:
+        if movers['top_rate'].empty:
             st.warning("No hay datos disponibles para mostrar top movers")
             return
 
@@ -582,26 +795,20 @@ def display_top_movers(comparison_df):
 
         # Mejores en Rate
         st.write("Mayor Mejora en Rate")
-        top_rate = comparison_df.nlargest(5, 'Rate_Change')[
-            ['ID', 'Last_Rate', 'Current_Rate', 'Rate_Change']
-        ].round(2)
-        st.dataframe(top_rate, use_container_width=True)
+        st.dataframe(movers['top_rate'], use_container_width=True)
 
         # Mejores en UIT
         st.write("Mayor Mejora en UIT (Reducción)")
-        top_uit = comparison_df.nsmallest(5, 'UIT_Change')[
-            ['ID', 'Last_UIT', 'Current_UIT', 'UIT_Change']
-        ].round(2)
-        st.dataframe(top_uit, use_container_width=True)
+        st.dataframe(movers['top_uit'], use_container_width=True)
 
     except Exception as e:
         logging.error(f"Error en top movers: {str(e)}")
         st.error("Error al mostrar los top movers")
 
-def display_bottom_movers(comparison_df):
+def display_bottom_movers(movers):
     """Muestra los casos que necesitan más atención"""
     try:
-        if comparison_df.empty:
+        if movers['bottom_rate'].empty:
             st.warning("No hay datos disponibles para mostrar bottom movers")
             return
 
@@ -609,23 +816,17 @@ def display_bottom_movers(comparison_df):
 
         # Peores en Rate
         st.write("Mayor Disminución en Rate")
-        bottom_rate = comparison_df.nsmallest(5, 'Rate_Change')[
-            ['ID', 'Last_Rate', 'Current_Rate', 'Rate_Change']
-        ].round(2)
-        st.dataframe(bottom_rate, use_container_width=True)
+        st.dataframe(movers['bottom_rate'], use_container_width=True)
 
         # Peores en UIT
         st.write("Mayor Incremento en UIT")
-        bottom_uit = comparison_df.nlargest(5, 'UIT_Change')[
-            ['ID', 'Last_UIT', 'Current_UIT', 'UIT_Change']
-        ].round(2)
-        st.dataframe(bottom_uit, use_container_width=True)
+        st.dataframe(movers['bottom_uit'], use_container_width=True)
 
     except Exception as e:
         logging.error(f"Error en bottom movers: {str(e)}")
         st.error("Error al mostrar los bottom movers")
 
-def display_recommendations(comparison_df, df_current):
+def display_recommendations(comparison_df):
     """Genera y muestra recomendaciones"""
     try:
         if comparison_df.empty:
@@ -634,16 +835,13 @@ def display_recommendations(comparison_df, df_current):
 
         st.subheader("Recomendaciones")
 
+        rc = comparison_df['Rate_Change'].to_numpy()
+        uc = comparison_df['UIT_Change'].to_numpy()
+
         # Análisis de casos críticos
-        critical_cases = len(comparison_df[
-            (comparison_df['Rate_Change'] < -10) &
-            (comparison_df['UIT_Change'] > 5)
-        ])
+        critical_cases = int(((rc < -10) & (uc > 5)).sum())
 
-        improvement_cases = len(comparison_df[
-            (comparison_df['Rate_Change'] > 0) &
-            (comparison_df['UIT_Change'] < 0)
-        ])
+        improvement_cases = int(((rc > 0) & (uc < 0)).sum())
 
         # Generar recomendaciones
         recommendations = []
@@ -654,17 +852,18 @@ def display_recommendations(comparison_df, df_current):
         if improvement_cases > 0:
             recommendations.append(f"✅ {improvement_cases} asociados muestran mejora general")
 
-        # Análisis por zona
-        for zone in df_current['Zone'].unique():
-            zone_data = comparison_df[comparison_df['Zone'] == zone]
-            if not zone_data.empty:
-                avg_rate_change = zone_data['Rate_Change'].mean()
-                avg_uit_change = zone_data['UIT_Change'].mean()
-                
-                if avg_rate_change < -5:
-                    recommendations.append(f"👉 {zone}: Requiere atención en Rate (cambio promedio: {avg_rate_change:.1f})")
-                if avg_uit_change > 3:
-                    recommendations.append(f"👉 {zone}: Requiere atención en UIT (cambio promedio: {avg_uit_change:.1f}%)")
+        # Análisis por zona: un único groupby (solo zonas con asociados)
+        zone_means = comparison_df.groupby('Zone', observed=True)[
+            ['Rate_Change', 'UIT_Change']
+        ].mean()
+        for zone, row in zone_means.iterrows():
+            avg_rate_change = row['Rate_Change']
+            avg_uit_change = row['UIT_Change']
+            
+            if avg_rate_change < -5:
+                recommendations.append(f"👉 {zone}: Requiere atención en Rate (cambio promedio: {avg_rate_change:.1f})")
+            if avg_uit_change > 3:
+                recommendations.append(f"👉 {zone}: Requiere atención en UIT (cambio promedio: {avg_uit_change:.1f}%)")
 
         # Mostrar recomendaciones
         if recommendations:
@@ -677,26 +876,43 @@ def display_recommendations(comparison_df, df_current):
         logging.error(f"Error en recomendaciones: {str(e)}")
         st.error("Error al generar recomendaciones")
 
-def calculate_zone_transitions(df_last, df_current):
-    """Analiza las transiciones entre zonas"""
+def calculate_zone_transitions(comparison_df):
+    """Analiza las transiciones entre zonas a partir del DataFrame de comparación"""
     try:
-        transitions = pd.crosstab(
-            df_last['Zone'],
-            df_current['Zone'],
-            margins=True
-        )
+        # Las filas ya están emparejadas por ID: trabajar con los códigos enteros de zona
+        last_codes = comparison_df['Last_Zone'].cat.codes.to_numpy(dtype=np.intp)
+        current_codes = comparison_df['Zone'].cat.codes.to_numpy(dtype=np.intp)
+        
+        # Matriz 4x4 como histograma de 16 celdas (un único bincount)
+        k = len(ZONE_LABELS)
+        matrix = np.zeros((k + 1, k + 1), dtype=np.int64)
+        matrix[:k, :k] = np.bincount(last_codes * k + current_codes, minlength=k * k).reshape(k, k)
+        
+        # Márgenes sobre el propio array
+        matrix[:k, k] = matrix[:k, :k].sum(axis=1)
+        matrix[k, :] = matrix[:k, :].sum(axis=0)
+        
+        labels = [*ZONE_LABELS, 'All']
+        transitions = pd.DataFrame(matrix, index=labels, columns=labels)
+        transitions.index.name = 'Zone'
+        transitions.columns.name = 'Zone'
         return transitions
     except Exception as e:
         logging.error(f"Error en análisis de transiciones: {str(e)}")
         return None
 
-def generate_individual_report(worker_id, comparison_df):
-    """Genera reporte individual para un trabajador"""
+def generate_individual_report(worker_id, comparison_by_id):
+    """Genera reporte individual para un trabajador a partir de la comparación indexada por ID"""
+    # Con IDs enteros, un RangeIndex devolvería otra fila sin error
+    if comparison_by_id.index.name != 'ID':
+        raise ValueError("La comparación debe estar indexada por ID (set_index('ID', drop=False))")
+    
     try:
-        if worker_id not in comparison_df['ID'].values:
+        # Búsqueda por índice hash en lugar de dos recorridos de la columna ID
+        try:
+            worker_data = comparison_by_id.loc[worker_id]
+        except KeyError:
             return None
-            
-        worker_data = comparison_df[comparison_df['ID'] == worker_id].iloc[0]
         
         report = {
             'ID': worker_id,
@@ -718,17 +934,40 @@ def generate_individual_report(worker_id, comparison_df):
         logging.error(f"Error en reporte individual: {str(e)}")
         return None
 
+@st.fragment
+def display_individual_report(comparison_by_id):
+    """Muestra el reporte individual; el selector de trabajador solo recarga esta sección"""
+    try:
+        st.subheader("Reporte Individual")
+        # Los IDs son únicos (validate='1:1' en la comparación)
+        selected_worker = st.selectbox(
+            "Seleccionar trabajador:",
+            comparison_by_id.index
+        )
+        
+        if selected_worker:
+            worker_report = generate_individual_report(
+                selected_worker, comparison_by_id
+            )
+            if worker_report:
+                st.write(worker_report)
+                
+    except Exception as e:
+        logging.error(f"Error en sección de reporte individual: {str(e)}")
+        st.error("Error al mostrar el reporte individual")
+
 def calculate_performance_trends(comparison_df):
     """Calcula tendencias de rendimiento"""
     try:
+        means = comparison_df[['Rate_Change', 'UIT_Change']].mean()
+        rc = comparison_df['Rate_Change'].to_numpy()
+        uc = comparison_df['UIT_Change'].to_numpy()
+        zc = comparison_df['Zone_Changed'].to_numpy()
         trends = {
-            'rate_trend': comparison_df['Rate_Change'].mean(),
-            'uit_trend': comparison_df['UIT_Change'].mean(),
-            'improved_overall': len(comparison_df[
-                (comparison_df['Rate_Change'] > 0) &
-                (comparison_df['UIT_Change'] < 0)
-            ]),
-            'zone_stability': (comparison_df['Zone'] == comparison_df['Last_Zone']).mean() * 100
+            'rate_trend': means['Rate_Change'],
+            'uit_trend': means['UIT_Change'],
+            'improved_overall': int(((rc > 0) & (uc < 0)).sum()),
+            'zone_stability': (~zc).mean() * 100
         }
         return trends
     except Exception as e:
@@ -739,13 +978,14 @@ def calculate_performance_trends(comparison_df):
 def generate_summary_statistics(df):
     """Genera estadísticas resumidas del DataFrame"""
     try:
+        agg = df[['RATES', 'UIT']].agg(['mean', 'median'])
         stats = {
             'total_associates': len(df),
-            'average_rate': df['RATES'].mean(),
-            'median_rate': df['RATES'].median(),
-            'average_uit': df['UIT'].mean(),
-            'median_uit': df['UIT'].median(),
-            'zone_distribution': df['Zone'].value_counts().to_dict()
+            'average_rate': agg.loc['mean', 'RATES'],
+            'median_rate': agg.loc['median', 'RATES'],
+            'average_uit': agg.loc['mean', 'UIT'],
+            'median_uit': agg.loc['median', 'UIT'],
+            'zone_distribution': _count_by_zone(df).to_dict()
         }
         return stats
     except Exception as e:
@@ -772,6 +1012,7 @@ def display_trend_analysis(comparison_df):
         st.error("Error al mostrar análisis de tendencias")
 
 
+@st.cache_data(show_spinner=False, ttl=3600)
 def analyze_tenure_by_zone(df):
     """
     Analiza la distribución de antigüedad por zona